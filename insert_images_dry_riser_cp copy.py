@@ -3,11 +3,14 @@ import re
 from PyPDF2 import PdfReader, PdfWriter
 from PIL import Image
 import io
+import img2pdf
+
+_BLOCK_RE = re.compile(r'^(\d{3})')
 
 def extract_block_numbers_from_filename(filename):
-    match = re.match(r'^(\d{3})', filename)
-    if match:
-        return int(match.group(1))
+    m = _BLOCK_RE.match(filename)
+    if m:
+        return int(m.group(1))
     else:
         print(f"Warning: Could not extract block number from image: {filename}")
         return None
@@ -27,27 +30,24 @@ BLOCKS_PER_PAGE = [
 ]
 
 def create_image_page(image_path, output_pdf_writer, width=612, height=792):
-    img = Image.open(image_path)
-    if img.mode != 'RGB':
-        img = img.convert('RGB')
-    img.thumbnail((width, height), Image.Resampling.LANCZOS)
-
-    from reportlab.pdfgen import canvas
-    from reportlab.lib.pagesizes import letter
-    from reportlab.lib.utils import ImageReader
-
-    packet = io.BytesIO()
-    can = canvas.Canvas(packet, pagesize=letter)
-    img_reader = ImageReader(img)
-    img_width, img_height = img.size
-    x = (width - img_width) / 2
-    y = (height - img_height) / 2
-    can.drawImage(img_reader, x, y, img_width, img_height)
-    can.showPage()
-    can.save()
-
-    packet.seek(0)
-    temp_reader = PdfReader(packet)
+    # img2pdf centres the image on a letter page, shrinking (never enlarging) it to fit;
+    # JPEGs are embedded as-is instead of being re-encoded. DPI is pinned to 72 so one
+    # pixel is one point, as before, instead of following the file's DPI metadata.
+    fit_page = img2pdf.get_layout_fun((width, height), fit=img2pdf.FitMode.shrink)
+
+    def layout(w_px, h_px, _ndpi):
+        return fit_page(w_px, h_px, (72, 72))
+
+    try:
+        pdf_bytes = img2pdf.convert(image_path, layout_fun=layout)
+    except Exception:
+        # e.g. PNGs with an alpha channel: flatten to RGB, kept lossless as PNG
+        buf = io.BytesIO()
+        with Image.open(image_path) as img:
+            img.convert('RGB').save(buf, format="PNG")
+        pdf_bytes = img2pdf.convert(buf.getvalue(), layout_fun=layout)
+
+    temp_reader = PdfReader(io.BytesIO(pdf_bytes))
     output_pdf_writer.add_page(temp_reader.pages[0])
 
 def main():
@@ -3,153 +3,400 @@
 import os
 import re
 import io
-import tempfile
+import json
+import hashlib
+import queue
+import threading
+import img2pdf
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
 from PIL import Image
 from PyPDF2 import PdfReader, PdfWriter
-import pdf2image
+import pypdfium2 as pdfium
 import easyocr
+import torch
 import numpy as np
 from natsort import natsorted
 
+try:
+    # libjpeg-turbo decodes JPEGs ~2x faster than stock libjpeg; PIL is the fallback
+    from turbojpeg import TurboJPEG, TJPF_RGB
+    _TURBO_JPEG = TurboJPEG()
+except (ImportError, OSError, RuntimeError):
+    _TURBO_JPEG = None
+
+_BLOCK_RE = re.compile(r'^(\d{3})')
+_THREE_DIGIT_RE = re.compile(r'\b\d{3}\b')
+
+OCR_BATCH_SIZE = 16
+PDF_WORKERS = 2  # PDFs processed at once; each worker process loads its own EasyOCR model
+OCR_DPI = 100  # render DPI for the header OCR pass only; 3-digit numbers don't need more
+HEADER_FRACTION = 0.15  # top share of each page that carries the block numbers
+HEADER_SIZE = (640, 136)  # (n_width, n_height) every header crop is resized to for batching
+
+CACHE_DIR = os.path.expanduser("~/.cache/merge_pdf")
+
+_READER = None
+
+
+def _get_reader():
+    """Load the EasyOCR model once per process and reuse it for every page."""
+    global _READER
+    if _READER is None:
+        _READER = easyocr.Reader(['en'], gpu=True, verbose=False, cudnn_benchmark=True)
+        detector = _READER.detector
+        if (hasattr(torch, "compile") and isinstance(detector, torch.nn.DataParallel)
+                and torch.cuda.device_count() == 1):
+            # gpu=True wraps CRAFT in DataParallel, which dynamo can't trace, so compile the
+            # inner module. Header crops are all HEADER_SIZE, so it compiles once.
+            detector.module = torch.compile(detector.module)
+        # Dummy batch so cuDNN autotunes (and torch.compile traces) before the real pages arrive
+        width, height = HEADER_SIZE
+        _READER.readtext_batched(np.zeros((OCR_BATCH_SIZE, height, width, 3), np.uint8),
+                                 batch_size=OCR_BATCH_SIZE)
+    return _READER
+
 
 def extract_block_from_filename(filename):
     """Extract leading 3-digit block number (e.g., '107' from '107_L5_....jpg')."""
-    match = re.match(r'^(\d{3})', filename)
-    return int(match.group(1)) if match else None
+    m = _BLOCK_RE.match(filename)
+    return int(m.group(1)) if m else None
+
 
+def render_page_header(page):
+    """Render only the top HEADER_FRACTION of a page (where block numbers appear), resized to HEADER_SIZE."""
+    _, height = page.get_size()
+    # crop is (left, bottom, right, top) in PDF points cut off the page before rasterizing
+    bitmap = page.render(scale=OCR_DPI / 72, crop=(0, height * (1 - HEADER_FRACTION), 0, 0))
+    header = bitmap.to_pil()
+    if header.mode != 'RGB':
+        header = header.convert('RGB')
+    # BILINEAR is plenty for a conv net, and CRAFT cost scales with pixel count
+    return np.array(header.resize(HEADER_SIZE, Image.Resampling.BILINEAR))
 
-def get_blocks_from_page_header(pil_image):
-    """OCR only the top portion of the page to get clean block numbers."""
-    # Crop top 15% of the image (where block numbers appear)
-    width, height = pil_image.size
-    cropped = pil_image.crop((0, 0, width, int(height * 0.15)))
 
-    reader = easyocr.Reader(['en'], verbose=False)
-    results = reader.readtext(np.array(cropped), detail=0)
+def get_blocks_from_page_header(results):
+    """Turn the OCR text of one page header into clean block numbers."""
     text = " ".join(results).replace('\n', ' ')
 
     # Extract 3-digit blocks (100-999)
-    blocks = [int(x) for x in re.findall(r'\b\d{3}\b', text) if 100 <= int(x) <= 999]
-    
+    blocks = [int(x) for x in _THREE_DIGIT_RE.findall(text) if 100 <= int(x) <= 999]
+
     # Deduplicate while preserving order
-    seen = set()
-    unique = []
-    for b in blocks:
-        if b not in seen:
-            unique.append(b)
-            seen.add(b)
-    return unique
+    return list(dict.fromkeys(blocks))
+
+
+def ocr_page_headers(crops):
+    """OCR a batch of header crops in one GPU call; returns one block list per crop."""
+    width, height = HEADER_SIZE
+    reader = _get_reader()
+    results = reader.readtext_batched(crops, n_width=width, n_height=height,
+                                      batch_size=OCR_BATCH_SIZE, detail=0)
+    return [get_blocks_from_page_header(r) for r in results]
 
 
-def image_to_pdf_page_safe(image_path, target_width_points, target_height_points, dpi=150):
+def load_rgb_image(image_path):
+    """Decode an image to RGB, through libjpeg-turbo for JPEGs when it is installed."""
+    if _TURBO_JPEG is not None and image_path.lower().endswith(('.jpg', '.jpeg')):
+        try:
+            with open(image_path, "rb") as f:
+                return Image.fromarray(_TURBO_JPEG.decode(f.read(), pixel_format=TJPF_RGB))
+        except Exception:
+            pass  # e.g. truncated JPEG; fall back to PIL
+    img = Image.open(image_path)
+    img.load()
+    return img if img.mode == 'RGB' else img.convert('RGB')
+
+
+def image_to_pdf_bytes_safe(image_path, target_width_points, target_height_points, dpi=150):
+    """Convert one image to a serialized single-page PDF (bytes), or None if it can't be read."""
     try:
         if not os.path.isfile(image_path) or os.path.getsize(image_path) == 0:
             raise OSError("File missing or empty")
 
-        img = Image.open(image_path)
-        img.load()
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
+        if image_path.lower().endswith(('.jpg', '.jpeg')):
+            try:
+                # Embed the JPEG stream as-is, centred on the page. Shrink-only and sized at
+                # `dpi` (ignoring the file's DPI tag), like the thumbnail() fallback below,
+                # so small photos are never scaled up
+                fit_page = img2pdf.get_layout_fun((target_width_points, target_height_points),
+                                                  fit=img2pdf.FitMode.shrink)
+
+                def layout_fun(w_px, h_px, _ndpi):
+                    return fit_page(w_px, h_px, (dpi, dpi))
+
+                return img2pdf.convert(image_path, layout_fun=layout_fun)
+            except Exception as e:
+                print(f"  ⚠️ img2pdf failed for {os.path.basename(image_path)} ({e}); re-encoding instead")
+
+        img = load_rgb_image(image_path)
 
         width_inch = target_width_points / 72.0
         height_inch = target_height_points / 72.0
         target_w = int(width_inch * dpi)
         target_h = int(height_inch * dpi)
 
-        img.thumbnail((target_w, target_h), Image.Resampling.LANCZOS)
+        # thumbnail() already box-reduces large photos by integer factors first
+        img.thumbnail((target_w, target_h), Image.Resampling.BILINEAR)
         canvas = Image.new('RGB', (target_w, target_h), (255, 255, 255))
         offset = ((target_w - img.width) // 2, (target_h - img.height) // 2)
         canvas.paste(img, offset)
 
-        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
-            canvas.save(tmp.name, "PDF", resolution=dpi)
-            tmp_path = tmp.name
-
-        reader = PdfReader(tmp_path)
-        page = reader.pages[0]
-        os.unlink(tmp_path)
-        return page
+        buf = io.BytesIO()
+        canvas.save(buf, "PDF", resolution=dpi)
+        return buf.getvalue()
 
     except Exception as e:
         print(f"  ⚠️ Skipped image: {os.path.basename(image_path)} | {e}")
         return None
 
 
-def main():
-    input_pdf_dir = "/Users/alfredlim/Redpower/merge_pdf/input"
-    image_dir = "/Users/alfredlim/Redpower/merge_pdf/images"
-    output_dir = "/Users/alfredlim/Redpower/merge_pdf/output"
-    os.makedirs(output_dir, exist_ok=True)
+def _image_to_pdf_bytes(task):
+    """Thread-pool worker: task is (image_path, target_width_points, target_height_points)."""
+    image_path, w, h = task
+    return image_to_pdf_bytes_safe(image_path, w, h, dpi=150)
 
-    pdf_files = [f for f in os.listdir(input_pdf_dir) if f.lower().endswith('.pdf')]
-    if not pdf_files:
-        print("❌ No PDF files found!")
-        return
 
-    # Index images by block
-    image_files = [f for f in os.listdir(image_dir) if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
-    images_by_block = {}
-    for img in image_files:
-        block = extract_block_from_filename(img)
-        if block is not None:
-            images_by_block.setdefault(block, []).append(img)
+# Render → OCR pipeline: each stage runs in its own thread, connected by bounded
+# queues, and pushes a None sentinel downstream when it is finished (or fails).
 
-    # Sort naturally
-    for block in images_by_block:
-        images_by_block[block] = natsorted(images_by_block[block])
+def _put(q, item, stop):
+    """q.put that gives up once `stop` is set, so a stage never blocks forever on a dead consumer."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
 
-    print(f"✅ Loaded {len(image_files)} images for {len(images_by_block)} blocks.")
 
-    for pdf_filename in pdf_files:
-        print(f"\n{'='*60}")
-        print(f"📄 Processing: {pdf_filename}")
-        print('='*60)
+def _run_stage(stage, out_q, errors, stop, *args):
+    try:
+        stage(*args)
+    except Exception as e:
+        errors.append(e)
+    finally:
+        _put(out_q, None, stop)
 
-        pdf_path = os.path.join(input_pdf_dir, pdf_filename)
-        output_path = os.path.join(output_dir, pdf_filename.replace('.pdf', '_WITH_IMAGES.pdf'))
 
-        # Convert PDF to images
-        print("🖼️ Converting PDF pages to images...")
-        pil_images = pdf2image.convert_from_path(pdf_path, dpi=150)
+def _render_headers(pdf_path, q_render, stop):
+    """Stage A: rasterize each page's header strip with PDFium and push it."""
+    pdf = pdfium.PdfDocument(pdf_path)
+    try:
+        for i in range(len(pdf)):
+            page = pdf[i]
+            header = render_page_header(page)
+            page.close()
+            if not _put(q_render, header, stop):
+                return  # OCR stage is gone; closing the document on the way out
+    finally:
+        pdf.close()
+
+
+def _ocr_headers(q_render, q_ocr, stop):
+    """Stage B: OCR header crops in batches and push (page_idx, blocks) in page order."""
+    page_idx = 0
+    batch = []
+    while True:
+        try:
+            crop = q_render.get(timeout=0.1)
+        except queue.Empty:
+            if stop.is_set():
+                return
+            continue
+        if crop is not None:
+            batch.append(crop)
+        if batch and (crop is None or len(batch) == OCR_BATCH_SIZE):
+            for blocks in ocr_page_headers(batch):
+                if not _put(q_ocr, (page_idx, blocks), stop):
+                    return
+                page_idx += 1
+            batch = []
+        if crop is None:
+            return
+
+
+def ocr_cache_path(pdf_path):
+    """Header-OCR cache file for this PDF, keyed by a hash of its contents."""
+    digest = hashlib.sha256()
+    with open(pdf_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return os.path.join(CACHE_DIR, f"{digest.hexdigest()[:16]}.json")
+
+
+def load_cached_blocks(cache_path):
+    """Blocks per page from an earlier run, or None if missing or made with other OCR settings."""
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("dpi") != OCR_DPI or data.get("header_size") != list(HEADER_SIZE):
+            return None
+        blocks_per_page = [[int(b) for b in page["clean_blocks"]] for page in data["pages"]]
+    except (OSError, ValueError, TypeError, KeyError, AttributeError):
+        # Unreadable or not shaped like our cache file (e.g. hand-edited): treat as a miss
+        return None
+    return blocks_per_page
 
-        orig_reader = PdfReader(pdf_path)
-        writer = PdfWriter()
 
-        for i, pil_img in enumerate(pil_images):
-            if i >= len(orig_reader.pages):
-                break
+def save_cached_blocks(cache_path, pdf_filename, blocks_per_page):
+    """Atomically write the header OCR results (same page layout as make_ocr_blocklist)."""
+    payload = {
+        "pdf": pdf_filename,
+        "dpi": OCR_DPI,
+        "header_size": list(HEADER_SIZE),
+        "pages": [
+            {"page_index": i, "clean_blocks": blocks}
+            for i, blocks in enumerate(blocks_per_page)
+        ],
+    }
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_path = cache_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, indent=2)
+    os.replace(tmp_path, cache_path)
+
+
+# Set once per PDF worker process by _init_worker, so the image index is pickled
+# once per worker instead of once per PDF
+_IMAGES_BY_BLOCK = {}
+
+
+def _init_worker(images_by_block):
+    global _IMAGES_BY_BLOCK
+    _IMAGES_BY_BLOCK = images_by_block
+
 
+def process_pdf(pdf_filename, input_pdf_dir, image_dir, output_dir, image_workers=8):
+    """OCR one PDF's page headers and insert the matching images after each page."""
+    images_by_block = _IMAGES_BY_BLOCK
+
+    print(f"\n{'='*60}")
+    print(f"📄 Processing: {pdf_filename}")
+    print('='*60)
+
+    pdf_path = os.path.join(input_pdf_dir, pdf_filename)
+    output_path = os.path.join(output_dir, pdf_filename.replace('.pdf', '_WITH_IMAGES.pdf'))
+
+    orig_reader = PdfReader(pdf_path)
+    num_pages = len(orig_reader.pages)
+
+    blocks_per_page = []
+    page_images = []   # per page: [(img_file, future PDF bytes)] in insertion order
+
+    # Header OCR results are cached by PDF content, so re-runs skip rendering and OCR
+    cache_path = ocr_cache_path(pdf_path)
+    cached_blocks = load_cached_blocks(cache_path)
+
+    # Images convert on a thread pool (Pillow releases the GIL while decoding/encoding),
+    # overlapping with OCR of later pages and with the PDF writing below
+    with ThreadPoolExecutor(max_workers=image_workers) as ex:
+        def queue_page_images(i, blocks):
+            page = orig_reader.pages[i]
+            w = float(page.mediabox.width)
+            h = float(page.mediabox.height)
+            blocks_per_page.append(blocks)
+            page_images.append([
+                (img_file, ex.submit(_image_to_pdf_bytes, (os.path.join(image_dir, img_file), w, h)))
+                for block in blocks if block in images_by_block
+                for img_file in images_by_block[block]
+            ])
+
+        if cached_blocks is not None:
+            print(f"♻️ Using cached header OCR: {cache_path}")
+            for i, blocks in enumerate(cached_blocks[:num_pages]):
+                queue_page_images(i, blocks)
+        else:
+            # Render page headers (PDFium, CPU) while the previous batch is being OCR'd
+            # (EasyOCR, GPU); as each page's blocks arrive, its matching images are queued
+            # for conversion.
+            print("🖼️ Rendering pages and reading block numbers from page headers...")
+            q_render = queue.Queue(maxsize=4)
+            q_ocr = queue.Queue(maxsize=4)
+            errors = []
+            stop = threading.Event()  # set when we stop reading, so stages blocked on a full queue exit
+            try:
+                threading.Thread(target=_run_stage, daemon=True,
+                                 args=(_render_headers, q_render, errors, stop, pdf_path, q_render, stop)).start()
+                threading.Thread(target=_run_stage, daemon=True,
+                                 args=(_ocr_headers, q_ocr, errors, stop, q_render, q_ocr, stop)).start()
+
+                for i, blocks in iter(q_ocr.get, None):
+                    if i < num_pages:
+                        queue_page_images(i, blocks)
+            finally:
+                stop.set()
+            if errors:
+                raise errors[0]
+            save_cached_blocks(cache_path, pdf_filename, blocks_per_page)
+
+        writer = PdfWriter()
+        for i, blocks in enumerate(blocks_per_page):
             # Step 1: Add original page
             writer.add_page(orig_reader.pages[i])
 
-            # Step 2: Extract block numbers from header (top of page)
-            blocks = get_blocks_from_page_header(pil_img)
+            # Step 2: Report the block numbers found in the header
             print(f"\n📄 Page {i+1} | Header blocks: {blocks}")
 
             # Step 3: Insert matching images
             added = False
-            page = orig_reader.pages[i]
-            w = float(page.mediabox.width)
-            h = float(page.mediabox.height)
-
-            for block in blocks:
-                if block in images_by_block:
-                    for img_file in images_by_block[block]:
-                        img_path = os.path.join(image_dir, img_file)
-                        pdf_page = image_to_pdf_page_safe(img_path, w, h, dpi=150)
-                        if pdf_page:
-                            writer.add_page(pdf_page)
-                            print(f"  ➕ Inserted: {img_file}")
-                            added = True
+            for img_file, future in page_images[i]:
+                pdf_bytes = future.result()
+                if pdf_bytes:
+                    writer.add_page(PdfReader(io.BytesIO(pdf_bytes)).pages[0])
+                    print(f"  ➕ Inserted: {img_file}")
+                    added = True
 
             if not added:
                 print("  ➖ No matching images")
 
-        # Save
-        print(f"\n📊 Final page count: {len(writer.pages)}")
-        with open(output_path, "wb") as f:
-            writer.write(f)
-        print(f"✅ Output: {output_path}")
+    # Save
+    print(f"\n📊 Final page count: {len(writer.pages)}")
+    with open(output_path, "wb") as f:
+        writer.write(f)
+    print(f"✅ Output: {output_path}")
+
+
+def main():
+    input_pdf_dir = "/Users/alfredlim/Redpower/merge_pdf/input"
+    image_dir = "/Users/alfredlim/Redpower/merge_pdf/images"
+    output_dir = "/Users/alfredlim/Redpower/merge_pdf/output"
+    os.makedirs(output_dir, exist_ok=True)
+
+    pdf_files = [f for f in os.listdir(input_pdf_dir) if f.lower().endswith('.pdf')]
+    if not pdf_files:
+        print("❌ No PDF files found!")
+        return
+
+    # Index images by block
+    # (scandir entries carry cached type/stat info, so no extra syscalls per file)
+    image_count = 0
+    images_by_block = defaultdict(list)
+    with os.scandir(image_dir) as it:
+        for entry in it:
+            if not entry.is_file() or not entry.name.lower().endswith(('.jpg', '.jpeg', '.png')):
+                continue
+            image_count += 1
+            block = extract_block_from_filename(entry.name)
+            if block is not None:
+                images_by_block[block].append(entry.name)
+
+    # Sort naturally
+    for block in images_by_block:
+        images_by_block[block] = natsorted(images_by_block[block])
+
+    print(f"✅ Loaded {image_count} images for {len(images_by_block)} blocks.")
+
+    # One worker process per PDF; the conversion threads are split between them
+    pdf_workers = min(len(pdf_files), PDF_WORKERS)
+    image_workers = max(2, min(os.cpu_count(), 8) // pdf_workers)
+    job = partial(process_pdf, input_pdf_dir=input_pdf_dir, image_dir=image_dir,
+                  output_dir=output_dir, image_workers=image_workers)
+    with ProcessPoolExecutor(max_workers=pdf_workers, initializer=_init_worker,
+                             initargs=(images_by_block,)) as ex:
+        list(ex.map(job, pdf_files))
 
     print(f"\n🎉 Done! Outputs in: {output_dir}")
 
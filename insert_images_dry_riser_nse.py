@@ -1,8 +1,11 @@
 import os
 import re
 import io
+from collections import defaultdict
 import img2pdf  # For reliable image-to-PDF conversion
-from PyPDF2 import PdfReader, PdfWriter
+import pikepdf
+
+_BLOCK_RE = re.compile(r'^(\d{3,})')
 
 # ✅ BLOCKS PER PAGE — extracted from DRY DISER NSC.pdf
 # Alphanumeric blocks (e.g., 671A, 701B) are normalized to base number (671, 701) for image matching
@@ -31,15 +34,14 @@ BLOCKS_PER_PAGE = [
 
 def extract_block_from_filename(filename):
     """Extract leading 3+ digit block number (e.g., '602', '935') from filename."""
-    match = re.match(r'^(\d{3,})', filename)
-    return int(match.group(1)) if match else None
+    m = _BLOCK_RE.match(filename)
+    return int(m.group(1)) if m else None
 
-def image_to_pdf_page(image_path):
-    """Convert image directly to a PDF page using img2pdf (no blank pages)."""
+def image_to_pdf(image_path):
+    """Convert image directly to a one-page PDF using img2pdf (no blank pages)."""
     with open(image_path, "rb") as f:
         pdf_bytes = img2pdf.convert(f)
-    reader = PdfReader(io.BytesIO(pdf_bytes))
-    return reader.pages[0]
+    return pikepdf.Pdf.open(io.BytesIO(pdf_bytes))
 
 def main():
     # 🔧 CONFIGURE THESE PATHS
@@ -50,24 +52,23 @@ def main():
     # Ensure output directory exists
     os.makedirs(os.path.dirname(output_file), exist_ok=True)
 
-    # Get all image files
-    image_files = [
-        f for f in os.listdir(image_dir)
-        if f.lower().endswith(('.jpg', '.jpeg', '.png'))
-    ]
-
-    # Group images by block number
-    images_by_block = {}
-    for img in image_files:
-        block = extract_block_from_filename(img)
-        if block is not None:
-            images_by_block.setdefault(block, []).append(img)
-        else:
-            print(f"⚠️ Skipping (no block prefix): {img}")
+    # Group image files by block number (single scandir pass, no per-file stat)
+    images_by_block = defaultdict(list)
+    with os.scandir(image_dir) as it:
+        for entry in it:
+            img = entry.name
+            if not entry.is_file() or not img.lower().endswith(('.jpg', '.jpeg', '.png')):
+                continue
+            block = extract_block_from_filename(img)
+            if block is not None:
+                images_by_block[block].append(img)
+            else:
+                print(f"⚠️ Skipping (no block prefix): {img}")
 
     # Build final PDF
-    reader = PdfReader(pdf_file)
-    writer = PdfWriter()
+    reader = pikepdf.Pdf.open(pdf_file)
+    writer = pikepdf.Pdf.new()
+    image_pdfs = []  # keep image PDFs open until save; their pages are copied lazily
 
     total_pages_in_pdf = len(reader.pages)
     total_pages_defined = len(BLOCKS_PER_PAGE)
@@ -77,7 +78,7 @@ def main():
 
     for i in range(min(total_pages_in_pdf, total_pages_defined)):
         blocks = BLOCKS_PER_PAGE[i]
-        writer.add_page(reader.pages[i])
+        writer.pages.append(reader.pages[i])
         print(f"📄 Page {i+1}: Blocks {blocks}")
 
         added = False
@@ -85,15 +86,16 @@ def main():
             if block in images_by_block:
                 for img_file in images_by_block[block]:
                     img_path = os.path.join(image_dir, img_file)
-                    writer.add_page(image_to_pdf_page(img_path))
+                    img_pdf = image_to_pdf(img_path)
+                    image_pdfs.append(img_pdf)
+                    writer.pages.extend(img_pdf.pages)
                     print(f"  ➕ Added: {img_file}")
                     added = True
         if not added:
             print("  ➖ No images for this page")
 
     # Save output PDF
-    with open(output_file, "wb") as f:
-        writer.write(f)
+    writer.save(output_file)
     
     print(f"\n✅ Done! Output saved as: {output_file}")
 
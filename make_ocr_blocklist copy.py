@@ -7,10 +7,12 @@ import numpy as np
 import pdf2image
 import easyocr
 
+_THREE_DIGIT_RE = re.compile(r'\b\d{3}\b')
+
 
 def extract_3digit_blocks(text):
     """Extract all 3-digit numbers from text (100–999)."""
-    return [int(x) for x in re.findall(r'\b\d{3}\b', text) if 100 <= int(x) <= 999]
+    return [int(x) for x in _THREE_DIGIT_RE.findall(text) if 100 <= int(x) <= 999]
 
 
 def crop_block_table_region(pil_image, page_index=None):
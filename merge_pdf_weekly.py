@@ -2,12 +2,38 @@
 import os
 import re
 import json
-from PyPDF2 import PdfReader, PdfWriter
+import time
+import hashlib
+import threading
+from contextlib import ExitStack
+from functools import partial
+import img2pdf
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import pikepdf
 from PIL import Image, ImageFile
 import io
 
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 
+try:
+    # libjpeg-turbo decodes JPEGs ~2x faster than stock libjpeg; PIL is the fallback
+    from turbojpeg import TurboJPEG, TJPF_RGB
+    _TURBO_JPEG = TurboJPEG()
+except (ImportError, OSError, RuntimeError):
+    _TURBO_JPEG = None
+
+CACHE_DIR = os.path.expanduser("~/.cache/merge_pdf")
+# Re-encoded image pages, one PDF file per entry. Each script has its own folder, because
+# each run prunes the folder down to the entries it used.
+PAGE_CACHE_DIR = os.path.join(
+    CACHE_DIR, f"image_pages_{os.path.splitext(os.path.basename(__file__))[0]}"
+)
+
+PAGE_CACHE_VERSION = 2  # bump whenever reencode_to_pdf_bytes changes, so stale cached pages miss
+
+PDF_WORKERS = 4  # PDFs processed at once; the image conversion threads are split between them
+
 def extract_block_from_filename(filename):
     """
     Extract block ID from image filename.
@@ -34,115 +60,177 @@ def extract_block_from_filename(filename):
                 return block_candidate
     return None
 
-def image_to_pdf_page(image_path, width_points, height_points, dpi=150):
+def jpeg_to_pdf_bytes(image_path, width_points, height_points):
+    """Embed a JPEG as-is (no decode/re-encode), fitted and centred on a page of the given size."""
+    layout_fun = img2pdf.get_layout_fun((width_points, height_points))
+    return img2pdf.convert(image_path, layout_fun=layout_fun)
+
+def load_rgb_image(image_path):
+    """Decode an image to RGB, through libjpeg-turbo for JPEGs when it is installed."""
+    if _TURBO_JPEG is not None and image_path.lower().endswith(('.jpg', '.jpeg')):
+        try:
+            with open(image_path, "rb") as f:
+                return Image.fromarray(_TURBO_JPEG.decode(f.read(), pixel_format=TJPF_RGB))
+        except Exception:
+            pass  # e.g. truncated JPEG; PIL can often salvage it
+    img = Image.open(image_path)
+    img.load()  # also closes the file for single-frame images
+    return img if img.mode == 'RGB' else img.convert('RGB')
+
+def reencode_to_pdf_bytes(image_path, width_points, height_points, dpi=150):
+    """Decode, resize and centre an image on a white page; returns PDF bytes or None."""
     try:
-        with Image.open(image_path) as img:
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
-
-            # Target size in inches
-            target_width_in = width_points / 72.0
-            target_height_in = height_points / 72.0
-
-            # Convert to pixels at desired DPI
-            target_width_px = int(target_width_in * dpi)
-            target_height_px = int(target_height_in * dpi)
-
-            img_width, img_height = img.size
-            img_ratio = img_width / img_height
-            target_ratio = target_width_px / target_height_px
-
-            # Determine new size to fill the target dimensions while preserving aspect ratio
-            if img_ratio > target_ratio:
-                # Image is wider than target -> fit to target width
-                new_width = target_width_px
-                new_height = int(new_width / img_ratio)
-            else:
-                # Image is taller or equal ratio -> fit to target height
-                new_height = target_height_px
-                new_width = int(new_height * img_ratio)
+        img = load_rgb_image(image_path)
+
+        # Target size in inches
+        target_width_in = width_points / 72.0
+        target_height_in = height_points / 72.0
 
-            # Resize the image using the calculated dimensions
-            # This will upscale if new dimensions are larger than original, downscale if smaller
-            resized_img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+        # Convert to pixels at desired DPI
+        target_width_px = int(target_width_in * dpi)
+        target_height_px = int(target_height_in * dpi)
 
-            # Create canvas at exact target size
-            canvas = Image.new('RGB', (target_width_px, target_height_px), (255, 255, 255))
+        img_width, img_height = img.size
+        img_ratio = img_width / img_height
+        target_ratio = target_width_px / target_height_px
 
-            # Center the resized image on the canvas
-            offset_x = (target_width_px - new_width) // 2
-            offset_y = (target_height_px - new_height) // 2
-            canvas.paste(resized_img, (offset_x, offset_y))
+        # Determine new size to fill the target dimensions while preserving aspect ratio
+        if img_ratio > target_ratio:
+            # Image is wider than target -> fit to target width
+            new_width = target_width_px
+            new_height = int(new_width / img_ratio)
+        else:
+            # Image is taller or equal ratio -> fit to target height
+            new_height = target_height_px
+            new_width = int(new_height * img_ratio)
+
+        # Resize the image using the calculated dimensions
+        # This will upscale if new dimensions are larger than original, downscale if smaller.
+        # Big downscales are first box-reduced by an integer factor (reducing_gap), and
+        # BILINEAR is indistinguishable from LANCZOS for inspection photos
+        resized_img = img.resize((new_width, new_height), Image.Resampling.BILINEAR,
+                                 reducing_gap=2.0)
+
+        # Create canvas at exact target size
+        canvas = Image.new('RGB', (target_width_px, target_height_px), (255, 255, 255))
+
+        # Center the resized image on the canvas
+        offset_x = (target_width_px - new_width) // 2
+        offset_y = (target_height_px - new_height) // 2
+        canvas.paste(resized_img, (offset_x, offset_y))
 
-            # Save canvas to PDF buffer
-            pdf_buffer = io.BytesIO()
-            canvas.save(pdf_buffer, format='PDF', resolution=dpi)
-            pdf_buffer.seek(0)
-            reader = PdfReader(pdf_buffer)
-            return reader.pages[0]
+        # Save canvas to PDF buffer
+        pdf_buffer = io.BytesIO()
+        canvas.save(pdf_buffer, format='PDF', resolution=dpi)
+        return pdf_buffer.getvalue()
 
     except Exception as e:
         print(f"  ⚠️ Skipped image: {os.path.basename(image_path)} | {e}")
         return None
 
-def main():
-    input_pdf_dir = "/Users/alfredlim/Redpower/merge_pdf/input"
-    image_dir = "/Users/alfredlim/Redpower/merge_pdf/images"
-    json_dir = "/Users/alfredlim/Redpower/merge_pdf/ocr"
-    output_dir = "/Users/alfredlim/Redpower/merge_pdf/output"
-    os.makedirs(output_dir, exist_ok=True)
+def image_to_pdf_bytes(image_path, width_points, height_points, dpi=150):
+    """Convert one image to a serialized single-page PDF (bytes), or None if it can't be read."""
+    if image_path.lower().endswith(('.jpg', '.jpeg')):
+        try:
+            return jpeg_to_pdf_bytes(image_path, width_points, height_points)
+        except Exception as e:
+            # Fall back to the PIL canvas path (e.g. truncated JPEGs it can salvage)
+            print(f"  ⚠️ img2pdf failed for {os.path.basename(image_path)} ({e}); re-encoding instead")
 
-    pdf_files = [f for f in os.listdir(input_pdf_dir) if f.lower().endswith('.pdf')]
-    if not pdf_files:
-        print("❌ No PDFs found.")
+    # Only re-encoded pages are cached: the img2pdf path above is already little more
+    # than a file read
+    try:
+        cache_path = page_cache_path(image_path, width_points, height_points, dpi)
+    except OSError as e:
+        print(f"  ⚠️ Skipped image: {os.path.basename(image_path)} | {e}")
+        return None
+    pdf_bytes = load_cached_page(cache_path)
+    if pdf_bytes is None:
+        pdf_bytes = reencode_to_pdf_bytes(image_path, width_points, height_points, dpi)
+        if pdf_bytes:
+            save_cached_page(cache_path, pdf_bytes)
+    return pdf_bytes
+
+def _image_to_pdf_bytes(task):
+    """Thread-pool worker: task is (image_path, width_points, height_points)."""
+    image_path, width_points, height_points = task
+    return image_to_pdf_bytes(image_path, width_points, height_points, dpi=150)
+
+def page_cache_path(img_path, width_pts, height_pts, dpi=150):
+    """Cache file for a re-encoded image page; mtime+size invalidate it when the photo changes."""
+    st = os.stat(img_path)
+    key = f"{PAGE_CACHE_VERSION}|{img_path}|{st.st_mtime_ns}|{st.st_size}|{round(width_pts, 1)}|{round(height_pts, 1)}|{dpi}"
+    return os.path.join(PAGE_CACHE_DIR, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".pdf")
+
+def load_cached_page(cache_path):
+    """Read a cached page (touching it so this run's pruning keeps it), or None on a miss."""
+    try:
+        with open(cache_path, "rb") as f:
+            pdf_bytes = f.read()
+        os.utime(cache_path)
+        return pdf_bytes
+    except OSError:
+        return None
+
+def save_cached_page(cache_path, pdf_bytes):
+    """Atomically write one cached page (temp file unique to this thread, then rename)."""
+    tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(PAGE_CACHE_DIR, exist_ok=True)
+        with open(tmp_path, "wb") as f:
+            f.write(pdf_bytes)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        print(f"  ⚠️ Could not cache page {os.path.basename(cache_path)} ({e})")
+
+def prune_page_cache(run_started):
+    """Delete cached pages this run neither read nor wrote."""
+    try:
+        entries = list(os.scandir(PAGE_CACHE_DIR))
+    except OSError:
         return
+    for entry in entries:
+        if entry.stat().st_mtime < run_started:
+            os.remove(entry.path)
 
-    # Build image index: block (str) -> list of image paths
-    image_files = [f for f in os.listdir(image_dir) if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
-    images_by_block = {}
-    for img_file in image_files:
-        img_path = os.path.join(image_dir, img_file)
-        if os.path.getsize(img_path) == 0:
-            print(f"⚠️ Skipping empty file: {img_file}")
-            continue
-        block = extract_block_from_filename(img_file)
-        if block is not None:
-            images_by_block.setdefault(block, []).append(img_path)
-        else:
-            print(f"⚠️ Skipping (no valid block): {img_file}")
+# Set once per PDF worker process by _init_worker, so the image index is pickled once per
+# worker instead of once per PDF
+_IMAGES_BY_BLOCK = {}
 
-    # Sort images within each block
-    for block in images_by_block:
-        images_by_block[block].sort()
+def _init_worker(images_by_block):
+    global _IMAGES_BY_BLOCK
+    _IMAGES_BY_BLOCK = images_by_block
 
-    print(f"✅ Loaded {len(image_files)} images for {len(images_by_block)} blocks.")
+def process_pdf(pdf_filename, input_pdf_dir, json_dir, output_dir, image_workers=8):
+    """Append the images matching each page's blocks to the end of one PDF."""
+    images_by_block = _IMAGES_BY_BLOCK
 
-    # Process each PDF
-    for pdf_filename in pdf_files:
-        base_name = os.path.splitext(pdf_filename)[0]
-        json_path = os.path.join(json_dir, f"{base_name}_blocks.json")
-        pdf_path = os.path.join(input_pdf_dir, pdf_filename)
-        output_path = os.path.join(output_dir, f"{base_name}_WITH_IMAGES.pdf")
+    base_name = os.path.splitext(pdf_filename)[0]
+    json_path = os.path.join(json_dir, f"{base_name}_blocks.json")
+    pdf_path = os.path.join(input_pdf_dir, pdf_filename)
+    output_path = os.path.join(output_dir, f"{base_name}_WITH_IMAGES.pdf")
 
-        if not os.path.isfile(json_path):
-            print(f"⚠️ Skipping {pdf_filename}: JSON not found")
-            continue
+    if not os.path.isfile(json_path):
+        print(f"⚠️ Skipping {pdf_filename}: JSON not found")
+        return
 
-        with open(json_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
+    with open(json_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
 
-        print(f"\n📄 Processing: {pdf_filename}")
-        reader = PdfReader(pdf_path)
-        total_pdf_pages = len(reader.pages)
+    print(f"\n📄 Processing: {pdf_filename}")
+    # Image pages are appended straight onto the opened original (libqpdf writes one
+    # consolidated xref at save time), so the original pages are never copied or held in
+    # Python; each image PDF is opened once and stays open until save, because its pages
+    # are copied lazily
+    with pikepdf.Pdf.open(pdf_path) as pdf, ExitStack() as image_pdfs:
+        total_pdf_pages = len(pdf.pages)
         print(f"   Found {total_pdf_pages} pages in PDF.")
 
-        final_writer = PdfWriter()
-        all_collected_image_pages = []
+        worklist = []  # (img_path, width_pts, height_pts) for every matching image, in order
 
-        # First pass: add all original pages + collect matching images
+        # First pass: keep all original pages + collect matching images
         for i in range(total_pdf_pages):
-            original_page = reader.pages[i]
-            final_writer.add_page(original_page)
+            original_page = pdf.pages[i]
 
             # Get blocks for this page (if available)
             if i < len(data["pages"]):
@@ -151,27 +239,90 @@ def main():
                 print(f"  ➕ Page {i+1}: blocks {blocks}")
 
                 # Collect matching images
-                width_pts = float(original_page.mediabox.width)
-                height_pts = float(original_page.mediabox.height)
+                media_box = original_page.mediabox
+                width_pts = float(media_box[2]) - float(media_box[0])
+                height_pts = float(media_box[3]) - float(media_box[1])
                 for block in blocks:
                     if block in images_by_block:
                         for img_path in images_by_block[block]:
                             print(f"    ➕ Queuing image: {os.path.basename(img_path)}")
-                            img_page = image_to_pdf_page(img_path, width_pts, height_pts, dpi=150)
-                            if img_page:
-                                all_collected_image_pages.append(img_page)
+                            worklist.append((img_path, width_pts, height_pts))
             else:
                 print(f"  ⚠️ Page {i+1}: no JSON entry — keeping original page only.")
 
-        # Second pass: append all collected images at the END
-        for img_page in all_collected_image_pages:
-            final_writer.add_page(img_page)
+        # Convert each distinct (image, page size) once. Threads are enough here: Pillow
+        # releases the GIL while it decodes/resizes/encodes, and file reads overlap with
+        # appending pages below.
+        unique_tasks = list(dict.fromkeys(worklist))
+        print(f"   Converting {len(unique_tasks)} image(s) for {len(worklist)} insertion(s).")
+
+        opened = {}  # task -> open image Pdf (None if unreadable), so repeated images are parsed once
+        with ThreadPoolExecutor(max_workers=image_workers) as ex:
+            futures = {task: ex.submit(_image_to_pdf_bytes, task) for task in unique_tasks}
+
+            # Second pass: append all collected images at the END, in order, as they finish
+            for task in worklist:
+                if task not in opened:
+                    pdf_bytes = futures.pop(task).result()
+                    opened[task] = image_pdfs.enter_context(
+                        pikepdf.Pdf.open(io.BytesIO(pdf_bytes))) if pdf_bytes else None
+                if opened[task] is not None:
+                    pdf.pages.extend(opened[task].pages)
+
+        # Save final PDF (written sequentially by libqpdf; no linearization pass)
+        pdf.save(output_path, linearize=False)
+    print(f"✅ Output saved: {output_path}")
+
+def main():
+    input_pdf_dir = "/Users/alfredlim/Redpower/merge_pdf/input"
+    image_dir = "/Users/alfredlim/Redpower/merge_pdf/images"
+    json_dir = "/Users/alfredlim/Redpower/merge_pdf/ocr"
+    output_dir = "/Users/alfredlim/Redpower/merge_pdf/output"
+    os.makedirs(output_dir, exist_ok=True)
+
+    pdf_files = [f for f in os.listdir(input_pdf_dir) if f.lower().endswith('.pdf')]
+    if not pdf_files:
+        print("❌ No PDFs found.")
+        return
+
+    # Build image index: block (str) -> list of image paths
+    # (scandir entries carry cached type/stat info and the full path, so no extra syscalls)
+    image_count = 0
+    images_by_block = defaultdict(list)
+    with os.scandir(image_dir) as it:
+        for entry in it:
+            img_file = entry.name
+            if not entry.is_file() or not img_file.lower().endswith(('.jpg', '.jpeg', '.png')):
+                continue
+            image_count += 1
+            if entry.stat().st_size == 0:
+                print(f"⚠️ Skipping empty file: {img_file}")
+                continue
+            block = extract_block_from_filename(img_file)
+            if block is not None:
+                images_by_block[block].append(entry.path)
+            else:
+                print(f"⚠️ Skipping (no valid block): {img_file}")
+
+    # Sort images within each block
+    for block in images_by_block:
+        images_by_block[block].sort()
+
+    print(f"✅ Loaded {image_count} images for {len(images_by_block)} blocks.")
+
+    # Cached pages this run doesn't touch are pruned afterwards (1 s slack for coarse mtimes)
+    run_started = time.time() - 1
 
-        # Save final PDF
-        with open(output_path, "wb") as f:
-            final_writer.write(f)
-        print(f"✅ Output saved: {output_path}")
+    # Up to PDF_WORKERS worker processes; together they run at most min(cpu, 8) conversion threads
+    pdf_workers = min(len(pdf_files), PDF_WORKERS, os.cpu_count())
+    image_workers = max(1, min(os.cpu_count(), 8) // pdf_workers)
+    job = partial(process_pdf, input_pdf_dir=input_pdf_dir, json_dir=json_dir,
+                  output_dir=output_dir, image_workers=image_workers)
+    with ProcessPoolExecutor(max_workers=pdf_workers, initializer=_init_worker,
+                             initargs=(images_by_block,)) as ex:
+        list(ex.map(job, pdf_files))
 
+    prune_page_cache(run_started)
     print(f"\n🎉 All done! Outputs in: {output_dir}")
 
 if __name__ == "__main__":
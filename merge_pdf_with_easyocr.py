@@ -3,21 +3,47 @@
 import os
 import re
 import io
-from PyPDF2 import PdfReader, PdfWriter
-import pdf2image  # Converts PDF pages to PIL images
-import easyocr
+import queue
+import threading
+import functools
+import tempfile
+from contextlib import ExitStack
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import pikepdf
+import fitz  # PyMuPDF: renders PDF pages in-process
 import numpy as np
 
 from PIL import Image, ImageFile
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 
+try:
+    # Only needed when OCR_BACKEND = "tesseract"
+    import pytesseract
+except ImportError:
+    pytesseract = None
+
+OCR_BATCH_SIZE = 8
+OCR_DPI = 100  # render DPI for OCR only; 3-digit numbers don't need more (image pages stay at 150)
+OCR_PAGE_SIZE = (827, 1169)  # (n_width, n_height): A4 at OCR_DPI; every page is resized to this for batching
+OCR_BATCH_TIMEOUT = 0.5  # seconds to wait for a full batch before OCR'ing a partial one
+OCR_BACKEND = "easyocr"  # or "tesseract": digit-whitelisted Tesseract, several times faster on CPU for plain checklists
+TESSERACT_DPI = 300  # Tesseract loses accuracy fast below ~300 DPI, so it gets its own render DPI
+TESSERACT_CONFIG = "--psm 6 -c tessedit_char_whitelist=0123456789"
+PDF_WORKERS = 2  # PDFs processed at once; each worker process loads its own EasyOCR model
+FLUSH_EVERY_PAGES = 50  # output pages held in memory before they're written out to a temp part file
+
+_READER = None
+
 # ----------------------------
 # Filename → block extraction
 # ----------------------------
 
+PREFIX_RE = re.compile(r'^(\d{3})')                               # leading block number in filenames
+BLOCK_RE  = re.compile(r'\b\d{3}\b')                              # 3-digit numbers in OCR text
+
 def extract_block_from_filename(filename: str):
     """Extract leading 3-digit block number (e.g., '107' from '107_L5_....jpg')."""
-    match = re.match(r'^(\d{3})', filename)
+    match = PREFIX_RE.match(filename)
     return int(match.group(1)) if match else None
 
 
@@ -25,8 +51,8 @@ def extract_block_from_filename(filename: str):
 # Intra-block image sorting
 # ----------------------------
 
-L_RE   = re.compile(r'_L(\d+)\b', re.IGNORECASE)                 # _L5, _L10, etc.
-SEQ_RE = re.compile(r'(?:_|-)(\d{1,3})(?=\D|$)')                 # trailing _01, -12, etc.
+# group 1: level (_L5, _L10, etc.); group 2: trailing number token (_01, -12, etc.)
+KEY_RE = re.compile(r'_L(\d+)\b|(?:_|-)(\d{1,3})(?=\D|$)', re.IGNORECASE)
 
 def image_sort_key(name: str):
     """
@@ -35,56 +61,178 @@ def image_sort_key(name: str):
       2) A simple trailing number token (if any)
       3) Filename (lowercased) as stable fallback
     """
-    lvl_match = L_RE.search(name)
-    lvl_val = int(lvl_match.group(1)) if lvl_match else 9999
+    lvl_val = seq_val = None
+    # One scan for both tokens; the first match of each kind wins
+    for lvl, seq in (m.groups() for m in KEY_RE.finditer(name)):
+        if lvl is not None:
+            lvl_val = int(lvl) if lvl_val is None else lvl_val
+        elif seq_val is None:
+            seq_val = int(seq)
+        if lvl_val is not None and seq_val is not None:
+            break
 
-    seq_match = SEQ_RE.search(name)
-    seq_val = int(seq_match.group(1)) if seq_match else 9999
-
-    return (lvl_val, seq_val, name.lower())
+    return (9999 if lvl_val is None else lvl_val,
+            9999 if seq_val is None else seq_val,
+            name.lower())
 
 
 # ----------------------------
 # OCR extraction
 # ----------------------------
 
+def _get_reader():
+    """Load the EasyOCR model once per process and reuse it for every PDF."""
+    global _READER
+    if _READER is None:
+        # Imported here so the Tesseract backend runs without EasyOCR/torch installed
+        import easyocr
+        import torch
+
+        # Dynamic INT8 quantization is CPU-only, so only quantize when there is no GPU
+        use_gpu = torch.cuda.is_available()
+        _READER = easyocr.Reader(['en'], gpu=use_gpu, quantize=not use_gpu,
+                                 verbose=False, cudnn_benchmark=True)
+        # Dummy batch so cuDNN autotunes its kernels before the real pages arrive
+        width, height = OCR_PAGE_SIZE
+        with torch.inference_mode():
+            _READER.readtext_batched(np.zeros((OCR_BATCH_SIZE, height, width, 3), np.uint8),
+                                     batch_size=OCR_BATCH_SIZE)
+    return _READER
+
+
+def _put(q, item, stop):
+    """q.put that gives up once `stop` is set, so a stage never blocks forever on a dead consumer."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _run_stage(stage, out_q, errors, stop, *args):
+    """Run one pipeline stage, recording any error and always sending the end-of-stream sentinel."""
+    try:
+        stage(*args)
+    except Exception as e:
+        errors.append(e)
+    finally:
+        _put(out_q, None, stop)
+
+
+def _render_pages(pdf_path, render_q, stop):
+    """Stage A: rasterize each page in-process with MuPDF and push its pixel array."""
+    with fitz.open(pdf_path) as doc:
+        for page in doc:
+            if OCR_BACKEND == "tesseract":
+                # Grayscale keeps 300 DPI pages to a third of the memory; Tesseract binarizes anyway
+                pix = page.get_pixmap(dpi=TESSERACT_DPI, colorspace=fitz.csGRAY)
+                img_array = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width)
+            else:
+                pix = page.get_pixmap(dpi=OCR_DPI)  # RGB, no alpha
+                img_array = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+            if not _put(render_q, img_array, stop):
+                return  # OCR stage is gone; closing the document on the way out
+
+
+def _ocr_batch(batch):
+    """OCR a batch of page arrays with OCR_BACKEND; returns one list of text pieces per page."""
+    if OCR_BACKEND == "tesseract":
+        if pytesseract is None:
+            raise ImportError('OCR_BACKEND = "tesseract" needs `pip install pytesseract` (and the tesseract binary)')
+        return [[pytesseract.image_to_string(img_array, config=TESSERACT_CONFIG)] for img_array in batch]
+
+    reader = _get_reader()
+    import torch  # lazy for the same reason as in _get_reader, which has already loaded it
+    width, height = OCR_PAGE_SIZE
+    # One CRAFT forward pass per batch instead of one per page
+    # Digits only: prunes the recognizer's decoding (any word it reads is forced into digits).
+    # min_size is lowered from EasyOCR's default of 20 on purpose: at OCR_DPI = 100 the
+    # digit boxes are smaller than at the old 150 DPI and would otherwise be dropped.
+    with torch.inference_mode():
+        return reader.readtext_batched(batch, n_width=width, n_height=height,
+                                       batch_size=OCR_BATCH_SIZE, detail=0,
+                                       allowlist='0123456789', paragraph=False,
+                                       min_size=12)
+
+
+def _ocr_pages(render_q, ocr_q, stop):
+    """Stage B: OCR pages in batches (full, or whatever arrived within OCR_BATCH_TIMEOUT) and push (page_idx, blocks)."""
+    page_idx = 0
+    batch = []
+    done = False
+    while not done:
+        timed_out = False
+        try:
+            img_array = render_q.get(timeout=OCR_BATCH_TIMEOUT)
+        except queue.Empty:
+            if stop.is_set():
+                return
+            timed_out = True
+        else:
+            if img_array is None:
+                done = True
+            else:
+                batch.append(img_array)
+
+        if batch and (done or timed_out or len(batch) == OCR_BATCH_SIZE):
+            for results in _ocr_batch(batch):
+                text = " ".join(results).replace('\n', ' ')
+
+                # Only 3-digit numbers from 100 to 999; KEEP duplicates
+                blocks = [int(x) for x in BLOCK_RE.findall(text) if 100 <= int(x) <= 999]
+                if not _put(ocr_q, (page_idx, blocks), stop):
+                    return
+                page_idx += 1
+            batch = []
+
+
 def get_blocks_per_page_with_ocr(pdf_path: str):
     """
     Use OCR + automatic noise removal.
     - Keeps duplicates per page (no per-page dedup) to match checklist-like behavior
     - Removes "global noise" (numbers present on every page) using presence (set) not counts
     """
-    print("🖼️ Converting PDF pages to images for OCR...")
-    pil_images = pdf2image.convert_from_path(pdf_path, dpi=150)
-    reader = easyocr.Reader(['en'], verbose=False)
-
     raw_blocks_per_page = []   # keeps duplicates in page order
-    page_sets = []             # sets per page for global-noise detection
-
-    for i, pil_img in enumerate(pil_images):
-        print(f"  📄 OCR Page {i+1}...", end="")
-        img_array = np.array(pil_img)
-        results = reader.readtext(img_array, detail=0)
-        text = " ".join(results)
-
-        # Only 3-digit numbers from 100 to 999; KEEP duplicates
-        blocks = [int(x) for x in re.findall(r'\b\d{3}\b', text) if 100 <= int(x) <= 999]
-        raw_blocks_per_page.append(blocks)
-        page_sets.append(set(blocks))
-        print(f" {blocks}")
-
-    # Numbers that appear on EVERY page (presence-based)
-    global_noise = set.intersection(*page_sets) if page_sets else set()
-    if global_noise:
-        print(f"\n🗑️ Auto-removed global noise (appears on all pages): {sorted(global_noise)}\n")
+
+    # Render pages (MuPDF, CPU) while the previous batch is being OCR'd (EasyOCR, GPU).
+    # Global noise needs every page, so composing the output still waits for the last page.
+    print("🖼️ Converting PDF pages to images for OCR...")
+    # At most one batch waits in the queue while another is being OCR'd, so resident
+    # page buffers stay at ~2 x OCR_BATCH_SIZE however long the PDF is
+    render_q = queue.Queue(maxsize=OCR_BATCH_SIZE)
+    ocr_q = queue.Queue(maxsize=16)
+    errors = []
+    stop = threading.Event()  # set when we stop reading, so stages blocked on a full queue exit
+    try:
+        threading.Thread(target=_run_stage, daemon=True,
+                         args=(_render_pages, render_q, errors, stop, pdf_path, render_q, stop)).start()
+        threading.Thread(target=_run_stage, daemon=True,
+                         args=(_ocr_pages, ocr_q, errors, stop, render_q, ocr_q, stop)).start()
+
+        for i, blocks in iter(ocr_q.get, None):
+            raw_blocks_per_page.append(blocks)
+            print(f"  📄 OCR Page {i+1}... {blocks}")
+    finally:
+        stop.set()
+    if errors:
+        raise errors[0]
+
+    # Numbers that appear on EVERY page (presence-based): count each 100-999 value
+    # once per page it's on, then keep the ones whose count equals the page count
+    page_arrays = [np.asarray(page_blocks, dtype=np.int32) for page_blocks in raw_blocks_per_page]
+    counts = np.zeros(900, dtype=np.int32)
+    for arr in page_arrays:
+        counts[np.unique(arr) - 100] += 1
+    noise_arr = np.flatnonzero(counts == len(page_arrays)) + 100 if page_arrays else np.empty(0, np.int32)
+    if noise_arr.size:
+        print(f"\n🗑️ Auto-removed global noise (appears on all pages): {noise_arr.tolist()}\n")
     else:
         print("\n✅ No global noise detected.\n")
 
     # Remove only global-noise numbers, preserving order and duplicates of others
-    clean_blocks_per_page = []
-    for page_blocks in raw_blocks_per_page:
-        filtered = [b for b in page_blocks if b not in global_noise]
-        clean_blocks_per_page.append(filtered)
+    clean_blocks_per_page = [arr[~np.isin(arr, noise_arr)].tolist() for arr in page_arrays]
 
     for i, blocks in enumerate(clean_blocks_per_page):
         print(f"  ✅ Page {i+1}: {blocks}")   # shows duplicates if present
@@ -168,53 +316,55 @@ def normalize_page_blocks(
 # ----------------------------
 
 def dedup_and_sort_desc(seq):
-    """Remove duplicates (keep first occurrence), then sort descending."""
-    return sorted(dict.fromkeys(seq), reverse=True)
+    """Remove duplicates, then sort descending."""
+    return sorted(set(seq), reverse=True)
 
 
 # ----------------------------
 # Image → single-page PDF
 # ----------------------------
 
-def image_to_pdf_page(image_path, target_width_points, target_height_points, dpi=150):
-    try:
-        if not os.path.isfile(image_path):
-            raise FileNotFoundError(f"Image not found: {image_path}")
-        if os.path.getsize(image_path) == 0:
-            raise OSError(f"Image is empty (0 bytes): {image_path}")
+@functools.lru_cache(maxsize=16)
+def _sizes(w_pts, h_pts, dpi):
+    """Canvas size in pixels for a page of w_pts x h_pts points rendered at dpi."""
+    return int(w_pts / 72.0 * dpi), int(h_pts / 72.0 * dpi)
 
+
+_CANVASES = threading.local()  # per image-worker thread: (w_px, h_px) -> reusable white RGB canvas
+
+def _blank_canvas(tw, th):
+    """Return this thread's canvas of the given size, cleared to white."""
+    if not hasattr(_CANVASES, "by_size"):
+        _CANVASES.by_size = {}
+    canvas = _CANVASES.by_size.get((tw, th))
+    if canvas is None:
+        canvas = _CANVASES.by_size[(tw, th)] = Image.new('RGB', (tw, th), (255, 255, 255))
+    else:
+        canvas.paste((255, 255, 255), (0, 0, tw, th))
+    return canvas
+
+
+def image_to_pdf_page(image_path, target_width_px, target_height_px, dpi=150):
+    try:
+        # main() already dropped missing/empty files from its directory scan
         with Image.open(image_path) as img:
+            if img.format == 'JPEG':
+                # Let libjpeg decode at 1/2, 1/4 or 1/8 scale while staying >= 2x the target size
+                img.draft('RGB', (target_width_px * 2, target_height_px * 2))
             # try to load & convert early (salvages many truncated JPEGs)
             img.load()
             if img.mode != "RGB":
                 img = img.convert("RGB")
 
-            width_inch = target_width_points / 72.0
-            height_inch = target_height_points / 72.0
-            target_width_px = int(width_inch * dpi)
-            target_height_px = int(height_inch * dpi)
-
             img.thumbnail((target_width_px, target_height_px), Image.Resampling.LANCZOS)
-            canvas = Image.new('RGB', (target_width_px, target_height_px), (255, 255, 255))
+            canvas = _blank_canvas(target_width_px, target_height_px)
             offset = ((target_width_px - img.width) // 2, (target_height_px - img.height) // 2)
             canvas.paste(img, offset)
 
-        # Save image as PDF into buffer
+        # Save image as a one-page PDF; the parent parses it once when adding the page
         pdf_buffer = io.BytesIO()
         canvas.save(pdf_buffer, format='PDF', resolution=dpi)
-        pdf_buffer.seek(0)
-
-        # Read and return the page in a way that detaches it from the buffer
-        temp_reader = PdfReader(pdf_buffer)
-        temp_writer = PdfWriter()
-        temp_writer.add_page(temp_reader.pages[0])
-
-        output_buffer = io.BytesIO()
-        temp_writer.write(output_buffer)
-        output_buffer.seek(0)
-
-        final_reader = PdfReader(output_buffer)
-        return final_reader.pages[0]
+        return pdf_buffer.getvalue()
 
     except (OSError, FileNotFoundError, ValueError, Exception) as e:
         print(f"  ⚠️ Skipping corrupted/invalid image: {os.path.basename(image_path)}")
@@ -222,6 +372,12 @@ def image_to_pdf_page(image_path, target_width_points, target_height_points, dpi
         return None
 
 
+def image_to_pdf_page_worker(task):
+    """Pool worker: convert one image and return its page as PDF bytes."""
+    img_path, target_width_px, target_height_px = task
+    return image_to_pdf_page(img_path, target_width_px, target_height_px, dpi=150)
+
+
 # ----------------------------
 # Pretty printer for logs
 # ----------------------------
@@ -231,6 +387,137 @@ def pretty_first_n(pairs, n=10):
            ("" if len(pairs) <= n else f" (+{len(pairs)-n} more)")
 
 
+# ----------------------------
+# Per-PDF worker
+# ----------------------------
+
+# Set once per PDF worker process by _init_worker
+_IMAGES_BY_BLOCK = None
+
+# Per PDF-worker process, shared by every PDF it handles:
+# (block, canvas_w_px, canvas_h_px) -> [(img_file, single-page PDF bytes or None)]
+_PAGE_BYTES = {}
+
+
+def _init_worker(images_by_block):
+    global _IMAGES_BY_BLOCK
+    _IMAGES_BY_BLOCK = images_by_block
+
+
+def process_one_pdf(pdf_filename, input_pdf_dir, output_dir, image_workers=8):
+    """OCR one PDF and write a copy with each page's block images inserted after it."""
+    images_by_block = _IMAGES_BY_BLOCK
+
+    print(f"\n{'='*60}")
+    print(f"📄 Processing: {pdf_filename}")
+    print('='*60)
+
+    pdf_path = os.path.join(input_pdf_dir, pdf_filename)
+    output_filename = os.path.splitext(pdf_filename)[0] + "_WITH_IMAGES.pdf"
+    output_path = os.path.join(output_dir, output_filename)
+
+    try:
+        blocks_per_page_ocr = get_blocks_per_page_with_ocr(pdf_path)
+
+        # Same key as _PAGE_BYTES -> [(img_file, open image Pdf or None)], for the current part
+        # only: each image is parsed once, and repeated inserts copy from the same Pdf so QPDF
+        # writes its image stream once. The image Pdfs stay open until the part is saved
+        # because their pages are copied lazily.
+        image_pages = {}
+        parts = []
+        # Every FLUSH_EVERY_PAGES output pages the writer is saved to a temp part file and
+        # closed with its image Pdfs, so memory stays bounded by one part, not the whole output
+        with pikepdf.Pdf.open(pdf_path) as reader, ExitStack() as part_stack, \
+                tempfile.TemporaryDirectory(dir=output_dir) as part_dir, \
+                ThreadPoolExecutor(max_workers=image_workers) as pool:
+            writer = part_stack.enter_context(pikepdf.Pdf.new())
+
+            def save_part():
+                part_path = os.path.join(part_dir, f"part{len(parts):04d}.pdf")
+                writer.save(part_path)
+                parts.append(part_path)
+
+            # Images convert on the thread pool (Pillow releases the GIL while decoding/encoding)
+            for i, blocks in enumerate(blocks_per_page_ocr):
+                if i >= len(reader.pages):
+                    break
+
+                # Normalize the page's block list to follow checklist-like contiguous runs
+                normalized_blocks = normalize_page_blocks(blocks, images_by_block)
+
+                # ✅ NEW: de-duplicate then sort DESC (highest block first)
+                normalized_blocks = dedup_and_sort_desc(normalized_blocks)
+
+                # Add original checklist page first
+                writer.pages.append(reader.pages[i])
+
+                print(f"\n📄 Page {i+1} | OCR blocks: {blocks if blocks else '[]'}")
+                print(f"   🔧 Normalized (dedup + DESC): {normalized_blocks if normalized_blocks else '[]'}")
+
+                # Get current PDF page size
+                media_box = reader.pages[i].mediabox
+                page_width = float(media_box[2]) - float(media_box[0])
+                page_height = float(media_box[3]) - float(media_box[1])
+
+                # Canvas size in pixels at 150 DPI; also the image-cache size key
+                size_key = _sizes(page_width, page_height, 150)
+                page_blocks = [b for b in normalized_blocks if b in images_by_block]
+
+                # Convert images only for blocks this process hasn't converted at this page size,
+                # in this PDF or an earlier one
+                unconverted = [b for b in page_blocks if (b, *size_key) not in _PAGE_BYTES]
+                tasks = [(img_path, *size_key)
+                         for block in unconverted for _, img_path in images_by_block[block]]
+                # map() yields in submission order, so each block gets its images back in order
+                converted = iter(pool.map(image_to_pdf_page_worker, tasks))
+                for block in unconverted:
+                    _PAGE_BYTES[(block, *size_key)] = [
+                        (img_file, next(converted)) for img_file, _ in images_by_block[block]]
+
+                for block in page_blocks:
+                    if (block, *size_key) not in image_pages:
+                        image_pages[(block, *size_key)] = [
+                            (img_file, part_stack.enter_context(pikepdf.Pdf.open(io.BytesIO(pdf_bytes)))
+                             if pdf_bytes else None)
+                            for img_file, pdf_bytes in _PAGE_BYTES[(block, *size_key)]]
+
+                insert_log = []
+                for block in page_blocks:
+                    for img_file, img_pdf in image_pages[(block, *size_key)]:
+                        if img_pdf is not None:
+                            writer.pages.extend(img_pdf.pages)
+                            insert_log.append((block, img_file))
+
+                if insert_log:
+                    print(f"  ➕ Inserted (first 10): {pretty_first_n(insert_log, 10)}")
+                else:
+                    print("  ➖ No matching images")
+
+                if len(writer.pages) >= FLUSH_EVERY_PAGES:
+                    save_part()
+                    part_stack.close()  # the part's writer and the image Pdfs it copied from
+                    image_pages.clear()
+                    writer = part_stack.enter_context(pikepdf.Pdf.new())
+
+            if len(writer.pages) or not parts:
+                save_part()
+
+            # Join the parts into the final PDF; QPDF streams page contents from the part files
+            if len(parts) == 1:
+                os.replace(parts[0], output_path)
+            else:
+                with pikepdf.Pdf.new() as merged, ExitStack() as part_pdfs:
+                    for part_path in parts:
+                        merged.pages.extend(part_pdfs.enter_context(pikepdf.Pdf.open(part_path)).pages)
+                    merged.save(output_path)
+        print(f"\n✅ Success! Output: {output_filename}")
+
+    except Exception as e:
+        print(f"\n❌ Error processing {pdf_filename}: {e}")
+        import traceback
+        traceback.print_exc()
+
+
 # ----------------------------
 # Main
 # ----------------------------
@@ -243,28 +530,41 @@ def main():
     os.makedirs(output_dir, exist_ok=True)
 
     # Get PDF files
-    pdf_files = [f for f in os.listdir(input_pdf_dir) if f.lower().endswith('.pdf')]
+    with os.scandir(input_pdf_dir) as it:
+        pdf_files = [e.name for e in it if e.name.lower().endswith('.pdf') and e.is_file()]
     if not pdf_files:
         print("❌ No PDF files found in input directory!")
         return
 
     print(f"📁 Found {len(pdf_files)} PDF file(s) to process:\n  - " + "\n  - ".join(pdf_files) + "\n")
 
-    # Load and group images by block
-    image_files = [f for f in os.listdir(image_dir) if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
+    # Load and group images by block as (name, path); scandir's cached stat data
+    # filters out empty files without a separate stat per image
     images_by_block = {}
     skipped_files = []
-
-    for img in image_files:
-        block = extract_block_from_filename(img)
-        if block is not None:
-            images_by_block.setdefault(block, []).append(img)
-        else:
-            skipped_files.append(img)
+    empty_files = []
+
+    with os.scandir(image_dir) as it:
+        for entry in it:
+            if not entry.name.lower().endswith(('.jpg', '.jpeg', '.png')) or not entry.is_file():
+                continue
+            if entry.stat().st_size == 0:
+                empty_files.append(entry.name)
+                continue
+            block = extract_block_from_filename(entry.name)
+            if block is not None:
+                images_by_block.setdefault(block, []).append((entry.name, entry.path))
+            else:
+                skipped_files.append(entry.name)
 
     # Stable sort to keep human-friendly order
     for block in images_by_block:
-        images_by_block[block] = sorted(images_by_block[block], key=image_sort_key)
+        images_by_block[block] = sorted(images_by_block[block], key=lambda item: image_sort_key(item[0]))
+
+    if empty_files:
+        print("\n⚠️ Skipped empty (0 bytes) image files:")
+        for f in empty_files:
+            print(f"  - {f}")
 
     if skipped_files:
         print("\n⚠️ Skipped image files (no valid 3-digit block prefix):")
@@ -276,78 +576,20 @@ def main():
     print("\n🖼️ Images grouped by block (first 8 shown each block):")
     if images_by_block:
         for block in sorted(images_by_block):
-            subset = images_by_block[block][:8]
+            subset = [name for name, _ in images_by_block[block][:8]]
             more = "" if len(images_by_block[block]) <= 8 else f" (+{len(images_by_block[block])-8} more)"
             print(f"  Block {block:03d}: {subset}{more}")
     else:
         print("  ❌ No valid images found.")
 
-    # Process each PDF
-    for pdf_filename in pdf_files:
-        print(f"\n{'='*60}")
-        print(f"📄 Processing: {pdf_filename}")
-        print('='*60)
-
-        pdf_path = os.path.join(input_pdf_dir, pdf_filename)
-        output_filename = os.path.splitext(pdf_filename)[0] + "_WITH_IMAGES.pdf"
-        output_path = os.path.join(output_dir, output_filename)
-
-        try:
-            blocks_per_page_ocr = get_blocks_per_page_with_ocr(pdf_path)
-            reader = PdfReader(pdf_path)
-            writer = PdfWriter()
-
-            for i, blocks in enumerate(blocks_per_page_ocr):
-                if i >= len(reader.pages):
-                    break
-
-                # Normalize the page's block list to follow checklist-like contiguous runs
-                normalized_blocks = normalize_page_blocks(blocks, images_by_block)
-
-                # ✅ NEW: de-duplicate then sort DESC (highest block first)
-                normalized_blocks = dedup_and_sort_desc(normalized_blocks)
-
-                # Add original checklist page first
-                writer.add_page(reader.pages[i])
-
-                print(f"\n📄 Page {i+1} | OCR blocks: {blocks if blocks else '[]'}")
-                print(f"   🔧 Normalized (dedup + DESC): {normalized_blocks if normalized_blocks else '[]'}")
-
-                # Get current PDF page size
-                media_box = reader.pages[i].mediabox
-                page_width = float(media_box.width)
-                page_height = float(media_box.height)
-
-                insert_log = []
-                for block in normalized_blocks:
-                    if block in images_by_block:
-                        # Insert all images for this block in stable order
-                        for img_file in images_by_block[block]:
-                            img_path = os.path.join(image_dir, img_file)
-                            pdf_page = image_to_pdf_page(
-                                img_path,
-                                target_width_points=page_width,
-                                target_height_points=page_height,
-                                dpi=150
-                            )
-                            if pdf_page is not None:
-                                writer.add_page(pdf_page)
-                                insert_log.append((block, img_file))
-
-                if insert_log:
-                    print(f"  ➕ Inserted (first 10): {pretty_first_n(insert_log, 10)}")
-                else:
-                    print("  ➖ No matching images")
-
-            # Save final PDF
-            with open(output_path, "wb") as f:
-                writer.write(f)
-            print(f"\n✅ Success! Output: {output_filename}")
-
-        except Exception as e:
-            print(f"\n❌ Error processing {pdf_filename}: {e}")
-            import traceback
-            traceback.print_exc()
+    pdf_workers = min(len(pdf_files), PDF_WORKERS)
+    image_workers = max(2, min(os.cpu_count(), 8) // pdf_workers)
+    job = functools.partial(process_one_pdf, input_pdf_dir=input_pdf_dir,
+                            output_dir=output_dir, image_workers=image_workers)
+    # images_by_block goes to each worker once via the initializer, not once per PDF
+    with ProcessPoolExecutor(max_workers=pdf_workers, initializer=_init_worker,
+                             initargs=(images_by_block,)) as ex:
+        list(ex.map(job, pdf_files))
 
     print(f"\n🎉 All done! Processed {len(pdf_files)} PDF(s). Outputs in: {output_dir}")
 